@@ -15,7 +15,6 @@ set "MIN_PYTHON_VERSION=3.7"
 set "SCRIPT_DIR=%~dp0"
 set "PROJECT_ROOT=%SCRIPT_DIR%"
 set "MAIN_SCRIPT=%PROJECT_ROOT%src\main.py"
-set "REQUIREMENTS_FILE=%PROJECT_ROOT%requirements.txt"
 
 REM 颜色代码 (Windows 10+ 支持 ANSI 转义序列)
 set "COLOR_RESET=[0m"
@@ -233,44 +232,14 @@ exit /b 0
 :check_dependencies
 call :print_info "检查 Python 依赖..."
 
-REM 检查 requirements.txt 是否存在
-if not exist "%REQUIREMENTS_FILE%" (
-    call :print_warning "未找到 requirements.txt，跳过依赖检查"
-    exit /b 0
-)
-
-REM 检查关键依赖 (requests)
-%PYTHON_CMD% -c "import requests" >nul 2>&1
+REM 程序只使用标准库 (orjson 为可选加速项), 这里只确认 HTTPS 测速所需的 ssl 模块可用
+%PYTHON_CMD% -c "import ssl" >nul 2>&1
 if %errorlevel% neq 0 (
-    call :print_info "检测到缺失依赖，正在安装..."
-
-    REM 尝试查找 pip
-    set "PIP_CMD="
-    for %%p in (pip pip3 py -m pip) do (
-        where %%p >nul 2>&1
-        if !errorlevel! equ 0 (
-            set "PIP_CMD=%%p"
-            goto :pip_found
-        )
-    )
-
-    :pip_found
-    if "!PIP_CMD!"=="" (
-        call :error_exit "未找到 pip，请先安装 pip" 1
-        exit /b 1
-    )
-
-    REM 安装依赖
-    !PIP_CMD! install -r "%REQUIREMENTS_FILE%"
-    if !errorlevel! neq 0 (
-        call :error_exit "依赖安装失败，请检查网络连接或手动安装" 1
-        exit /b 1
-    )
-
-    call :print_success "依赖安装完成"
-) else (
-    call :print_success "依赖检查通过"
+    call :error_exit "当前 Python 缺少 ssl 模块，无法进行 HTTPS 测速，请安装带 OpenSSL 支持的 Python" 1
+    exit /b 1
 )
+
+call :print_success "依赖检查通过"
 exit /b 0
 
 :check_main_script
@@ -11,7 +11,6 @@ set -euo pipefail  # 严格错误处理: -e 遇错退出, -u 未定义变量报
 readonly SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 readonly PROJECT_ROOT="${SCRIPT_DIR}"
 readonly MAIN_SCRIPT="${PROJECT_ROOT}/src/main.py"
-readonly REQUIREMENTS_FILE="${PROJECT_ROOT}/requirements.txt"
 readonly MIN_PYTHON_VERSION="3.7"
 
 # 颜色定义
@@ -140,44 +139,18 @@ check_python() {
     echo "$python_cmd"
 }
 
-# 检查并安装依赖
+# 检查依赖
+# 程序只使用标准库 (orjson 为可选加速项),这里只确认 HTTPS 测速所需的 ssl 模块可用
 check_dependencies() {
     local python_cmd="$1"
 
     print_info "检查 Python 依赖..."
 
-    # 检查 requirements.txt 是否存在
-    if [[ ! -f "$REQUIREMENTS_FILE" ]]; then
-        print_warning "未找到 requirements.txt，跳过依赖检查"
-        return 0
+    if ! "$python_cmd" -c "import ssl" &> /dev/null; then
+        error_exit "当前 Python 缺少 ssl 模块，无法进行 HTTPS 测速，请安装带 OpenSSL 支持的 Python" 1
     fi
 
-    # 检查关键依赖
-    if ! "$python_cmd" -c "import requests" &> /dev/null; then
-        print_info "检测到缺失依赖，正在安装..."
-
-        # 尝试使用 pip3 或 pip
-        local pip_cmd=""
-        for cmd in pip3 pip; do
-            if command_exists "$cmd"; then
-                pip_cmd="$cmd"
-                break
-            fi
-        done
-
-        if [[ -z "$pip_cmd" ]]; then
-            error_exit "未找到 pip，请先安装 pip" 1
-        fi
-
-        # 安装依赖
-        if ! "$pip_cmd" install -r "$REQUIREMENTS_FILE"; then
-            error_exit "依赖安装失败，请检查网络连接或手动安装" 1
-        fi
-
-        print_success "依赖安装完成"
-    else
-        print_success "依赖检查通过"
-    fi
+    print_success "依赖检查通过"
 }
 
 # 检查主程序文件
@@ -10,17 +10,26 @@ Cloudflare CDN 测试配置模块
 - 支持地理位置筛选和查询
 """
 
+import collections.abc
 import json
 import logging
+import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 from dataclasses import dataclass
 
+from models import DATACLASS_SLOTS, ServerEndpoint  # ServerEndpoint 保留导出,兼容旧代码的导入路径
+
+try:
+    import orjson  # 可选依赖: C 实现的 JSON 解析器，冷启动加载更快
+except ImportError:
+    orjson = None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+@dataclass(**DATACLASS_SLOTS)
 class IATALocation:
     """IATA机场位置信息数据类"""
     iata: str
@@ -31,23 +40,6 @@ class IATALocation:
     lon: float
 
 
-@dataclass
-class ServerEndpoint:
-    """IP位置信息数据类(用于测速结果)"""
-    ip: str
-    port: int
-    source_port: Optional[int] = None
-    tls: bool = False
-    datacenter: str = ""
-    region: str = ""
-    country: str = ""
-    city: str = ""
-    iata: str = ""
-    asn: Optional[int] = None
-    tcp_delay: Optional[float] = None
-    download_speed: Optional[float] = None
-
-
 class BestIPAPIClient:
     """
     Cloudflare CDN 测试配置客户端
@@ -76,6 +68,12 @@ class BestIPAPIClient:
         "1.1.1.1",
     ]
 
+    # 已解析的 locations.json 路径，所有实例共享
+    _locations_path: Optional[Path] = None
+
+    # locations.json 超过该大小 (10MB) 时改用 ijson 流式解析
+    STREAM_PARSE_THRESHOLD = 10 * 1024 * 1024
+
     def __init__(self, api_server: str = "", timeout: int = 30):
         """
         初始化配置客户端
@@ -86,41 +84,50 @@ class BestIPAPIClient:
         """
         self.timeout = timeout
         self._locations_cache: Optional[List[IATALocation]] = None
+        # 位置索引，与 _locations_cache 同步构建，用于 O(1) 查询
+        self._by_iata: Dict[str, IATALocation] = {}
+        self._by_region: Dict[str, List[IATALocation]] = {}
+        self._by_country: Dict[str, List[IATALocation]] = {}
         self._locations_file = self._find_locations_file()
 
         logger.info("Cloudflare CDN 配置客户端初始化完成 (本地模式)")
 
-    def _find_locations_file(self) -> Path:
+    @classmethod
+    def _find_locations_file(cls) -> Path:
         """
         查找 locations.json 文件路径
 
         按以下顺序查找:
-        1. D:\\项目\\bestIp\\locations\\locations.json (绝对路径)
-        2. ../locations/locations.json (相对于 src 目录)
-        3. ./locations/locations.json (相对于当前工作目录)
+        1. ../locations/locations.json (相对于 src 目录)
+        2. ./locations/locations.json (相对于当前工作目录)
+        3. D:\\项目\\bestIp\\locations\\locations.json (仅 Windows, 绝对路径)
+
+        找到的路径缓存在类属性中，后续实例化不再重复探测文件系统。
 
         Returns:
             文件路径对象
         """
-        # 优先使用绝对路径
-        absolute_path = Path(r"D:\项目\bestIp\locations\locations.json")
-        if absolute_path.exists():
-            return absolute_path
-
-        # 相对于当前文件的路径
-        current_file = Path(__file__).resolve()
-        relative_path = current_file.parent.parent / "locations" / "locations.json"
-        if relative_path.exists():
-            return relative_path
-
-        # 相对于当前工作目录
-        cwd_path = Path.cwd() / "locations" / "locations.json"
-        if cwd_path.exists():
-            return cwd_path
-
-        # 返回默认路径（即使不存在）
-        logger.warning(f"未找到 locations.json 文件，使用默认路径: {absolute_path}")
-        return absolute_path
+        if cls._locations_path is not None:
+            return cls._locations_path
+
+        candidates = [
+            # 相对于当前文件的路径
+            Path(__file__).resolve().parent.parent / "locations" / "locations.json",
+            # 相对于当前工作目录
+            Path.cwd() / "locations" / "locations.json",
+        ]
+        if sys.platform == "win32":
+            # 旧版本使用的绝对路径
+            candidates.append(Path(r"D:\项目\bestIp\locations\locations.json"))
+
+        for path in candidates:
+            if path.exists():
+                cls._locations_path = path
+                return path
+
+        # 返回默认路径（即使不存在），不缓存以便后续重新查找
+        logger.warning("未找到 locations.json 文件，使用默认路径: %s", candidates[0])
+        return candidates[0]
 
     def get_locations(self, iata: str = "", port: int = 0, asn: int = 0) -> List[ServerEndpoint]:
         """
@@ -146,46 +153,53 @@ class BestIPAPIClient:
         """
         # 使用缓存避免重复读取文件
         if self._locations_cache is not None:
-            logger.info(f"使用缓存的 {len(self._locations_cache)} 个 IATA 位置")
+            logger.info("使用缓存的 %d 个 IATA 位置", len(self._locations_cache))
             return self._locations_cache
 
         try:
             if not self._locations_file.exists():
-                logger.error(f"位置数据文件不存在: {self._locations_file}")
+                logger.error("位置数据文件不存在: %s", self._locations_file)
                 return []
 
-            logger.info(f"从本地文件加载 IATA 位置: {self._locations_file}")
+            logger.info("从本地文件加载 IATA 位置: %s", self._locations_file)
 
-            with open(self._locations_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = self._read_locations_data()
 
             locations = []
 
-            if isinstance(data, list):
-                for item in data:
-                    location = IATALocation(
-                        iata=item.get('iata', ''),
-                        city=item.get('city', ''),
-                        region=item.get('region', ''),
-                        country=item.get('cca2', ''),
-                        lat=item.get('lat', 0.0),
-                        lon=item.get('lon', 0.0)
+            if isinstance(data, (list, collections.abc.Iterator)):
+                # 单次推导式构建，get 预绑定为 dict.get 省去每个字段的属性查找
+                # 参数顺序: iata, city, region, country(cca2), lat, lon
+                # 地区/国家取值重复度高，驻留后所有记录共享同一字符串对象
+                get = dict.get
+                intern = sys.intern
+                locations = [
+                    IATALocation(
+                        get(item, 'iata', ''),
+                        get(item, 'city', ''),
+                        intern(get(item, 'region', '')),
+                        intern(get(item, 'cca2', '')),
+                        get(item, 'lat', 0.0),
+                        get(item, 'lon', 0.0)
                     )
-                    locations.append(location)
+                    for item in data
+                ]
 
-                logger.info(f"成功加载 {len(locations)} 个 IATA 位置")
+                logger.info("成功加载 %d 个 IATA 位置", len(locations))
             else:
-                logger.warning(f"意外的数据格式: {type(data)}")
+                logger.warning("意外的数据格式: %s", type(data))
 
-            # 缓存结果
+            # 缓存结果并建立索引
             self._locations_cache = locations
+            self._build_location_indexes(locations)
             return locations
 
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON 解析错误: {e}")
+        except ValueError as e:
+            # json.JSONDecodeError 与 orjson.JSONDecodeError 均为 ValueError 子类
+            logger.error("JSON 解析错误: %s", e)
             return []
         except Exception as e:
-            logger.error(f"加载位置数据失败: {e}")
+            logger.error("加载位置数据失败: %s", e)
             return []
 
     def get_speed_test_url(self) -> Optional[str]:
@@ -197,7 +211,7 @@ class BestIPAPIClient:
         Returns:
             速度测试 URL 字符串
         """
-        logger.info(f"使用硬编码速度测试 URL: {self.DEFAULT_SPEED_TEST_URL}")
+        logger.info("使用硬编码速度测试 URL: %s", self.DEFAULT_SPEED_TEST_URL)
         return self.DEFAULT_SPEED_TEST_URL
 
     def get_tcp_test_domain(self) -> Optional[str]:
@@ -209,7 +223,7 @@ class BestIPAPIClient:
         Returns:
             TCP 测试域名
         """
-        logger.info(f"使用硬编码 TCP 测试域名: {self.DEFAULT_TCP_TEST_DOMAIN}")
+        logger.info("使用硬编码 TCP 测试域名: %s", self.DEFAULT_TCP_TEST_DOMAIN)
         return self.DEFAULT_TCP_TEST_DOMAIN
 
     def get_fallback_speed_test_urls(self) -> List[str]:
@@ -230,6 +244,64 @@ class BestIPAPIClient:
         """
         return self.FALLBACK_TCP_TEST_DOMAINS.copy()
 
+    def _read_locations_data(self) -> Any:
+        """
+        解析 locations.json
+
+        默认一次性读取并解析（优先 orjson），对当前约 50KB 的数据最快；
+        文件超过 STREAM_PARSE_THRESHOLD 且安装了 ijson 时改为流式解析，
+        逐条产出位置记录，避免整个文件及其解析树同时驻留内存。
+
+        Returns:
+            解析结果 (一次性解析) 或位置记录迭代器 (流式解析)
+        """
+        if self._locations_file.stat().st_size >= self.STREAM_PARSE_THRESHOLD:
+            try:
+                import ijson
+            except ImportError:
+                logger.warning("locations.json 体积较大，但未安装 ijson，使用一次性解析")
+            else:
+                logger.info("locations.json 体积较大，使用 ijson 流式解析")
+                return self._stream_location_records(ijson)
+
+        raw = self._locations_file.read_bytes()
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    def _stream_location_records(self, ijson) -> Iterator[dict]:
+        """
+        使用 ijson 逐条产出顶层数组中的位置记录
+
+        Args:
+            ijson: 已导入的 ijson 模块
+
+        Yields:
+            单条位置记录字典
+        """
+        with open(self._locations_file, 'rb') as f:
+            # use_float: 数值解析为 float 而非 Decimal，与一次性解析结果一致
+            yield from ijson.items(f, 'item', use_float=True)
+
+    def _build_location_indexes(self, locations: List[IATALocation]):
+        """
+        为位置列表建立 IATA/地区/国家索引
+
+        Args:
+            locations: IATA 位置信息列表
+        """
+        by_iata: Dict[str, IATALocation] = {}
+        by_region: Dict[str, List[IATALocation]] = {}
+        by_country: Dict[str, List[IATALocation]] = {}
+
+        for loc in locations:
+            # 与原线性查找一致: 重复的 IATA 代码以第一条为准
+            by_iata.setdefault(loc.iata.upper(), loc)
+            by_region.setdefault(loc.region.lower(), []).append(loc)
+            by_country.setdefault(loc.country.upper(), []).append(loc)
+
+        self._by_iata = by_iata
+        self._by_region = by_region
+        self._by_country = by_country
+
     def filter_locations_by_region(self, region: str) -> List[IATALocation]:
         """
         按地区筛选 IATA 位置
@@ -240,9 +312,9 @@ class BestIPAPIClient:
         Returns:
             匹配的位置列表
         """
-        all_locations = self.get_iata_locations()
-        filtered = [loc for loc in all_locations if loc.region.lower() == region.lower()]
-        logger.info(f"筛选地区 '{region}': {len(filtered)} 个位置")
+        self.get_iata_locations()
+        filtered = list(self._by_region.get(region.lower(), []))
+        logger.info("筛选地区 '%s': %d 个位置", region, len(filtered))
         return filtered
 
     def filter_locations_by_country(self, country_code: str) -> List[IATALocation]:
@@ -255,9 +327,9 @@ class BestIPAPIClient:
         Returns:
             匹配的位置列表
         """
-        all_locations = self.get_iata_locations()
-        filtered = [loc for loc in all_locations if loc.country.upper() == country_code.upper()]
-        logger.info(f"筛选国家 '{country_code}': {len(filtered)} 个位置")
+        self.get_iata_locations()
+        filtered = list(self._by_country.get(country_code.upper(), []))
+        logger.info("筛选国家 '%s': %d 个位置", country_code, len(filtered))
         return filtered
 
     def get_location_by_iata(self, iata_code: str) -> Optional[IATALocation]:
@@ -270,12 +342,11 @@ class BestIPAPIClient:
         Returns:
             匹配的位置信息，未找到返回 None
         """
-        all_locations = self.get_iata_locations()
-        for loc in all_locations:
-            if loc.iata.upper() == iata_code.upper():
-                return loc
-        logger.warning(f"未找到 IATA 代码: {iata_code}")
-        return None
+        self.get_iata_locations()
+        loc = self._by_iata.get(iata_code.upper())
+        if loc is None:
+            logger.warning("未找到 IATA 代码: %s", iata_code)
+        return loc
 
     def close(self):
         """关闭客户端 (保留以兼容旧代码)"""
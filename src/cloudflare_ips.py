@@ -16,48 +16,111 @@ Cloudflare CDN 节点管理模块
 
 import ipaddress
 import itertools
+import os
 import random
-from typing import List, Dict, Optional
-from dataclasses import dataclass
+import socket
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 import logging
 
+from models import ServerEndpoint
+
 logger = logging.getLogger(__name__)
 
+# 大型网段在每个/24子网中选取的优质偏移位置
+# 偏移策略: [0,1,2,3,4] 起始段, [32,64,128] 特定段
+_SUBNET_POSITION_OFFSETS = (0, 1, 2, 3, 4, 32, 64, 128)
+
 
-@dataclass
-class ServerEndpoint:
+def _parse_cidr(cidr: str) -> Tuple[int, int]:
     """
-    CDN服务器端点信息
-
-    存储单个CDN节点的完整配置信息,包括网络地址、端口配置、
-    地理位置数据以及性能测试结果。
-
-    Attributes:
-        ip: IPv4地址
-        port: 服务端口
-        source_port: 源端口(0表示系统自动分配)
-        tls: 是否启用TLS加密
-        datacenter: 数据中心标识
-        region: 地理区域
-        country: 国家/地区代码
-        city: 城市名称
-        iata: IATA机场代码(用于地理位置标识)
-        asn: 自治系统号(Cloudflare ASN: 13335)
-        tcp_delay: TCP连接延迟(毫秒),测试后填充
-        download_speed: 下载速度(MB/s),测试后填充
+    解析CIDR网段为 (网络地址整数, 地址总数)
+
+    Args:
+        cidr: CIDR格式网段 (如 "104.16.0.0/13")
+
+    Returns:
+        (网络地址整数, 地址总数) 元组
+    """
+    network = ipaddress.ip_network(cidr)
+    return int(network.network_address), network.num_addresses
+
+
+# 32位无符号整数(网络字节序)打包器
+_pack_uint32 = struct.Struct('>I').pack
+
+
+def _ints_to_ips(ip_ints: Iterable[int]) -> List[str]:
+    """
+    批量将32位整数转换为点分十进制IPv4字符串
+
+    打包与格式化均为C实现,通过 map 串联避免逐个地址的Python层调用开销。
+
+    Args:
+        ip_ints: IP地址整数序列
+
+    Returns:
+        IP地址字符串列表
+    """
+    return list(map(socket.inet_ntoa, map(_pack_uint32, ip_ints)))
+
+
+def _expand_subnet_spec(spec: Sequence[Tuple[Sequence[str], Iterable[int]]]) -> Tuple[str, ...]:
+    """
+    按 (前两段前缀列表, 第三段取值) 规格展开 /24 子网起始地址
+
+    例如 (("104.16", "104.17"), range(2)) 展开为
+    104.16.0.0, 104.16.1.0, 104.17.0.0, 104.17.1.0
+
+    Args:
+        spec: 子网规格列表
+
+    Returns:
+        IP地址字符串元组,保持规格顺序
+    """
+    return tuple(
+        f"{prefix}.{third_octet}.0"
+        for prefixes, third_octets in spec
+        for prefix in prefixes
+        for third_octet in third_octets
+    )
+
+
+def _spread_subnet_ints(base_address: int, available_hosts: int, count: int) -> List[int]:
+    """
+    在大型网段中跨子网分散选择IP(整数形式)
+
+    一次性按 (子网序号 x 偏移位置) 网格计算全部候选地址。
+    子网步长不小于256而偏移位置均小于256,候选地址严格递增,无需去重。
+
+    Args:
+        base_address: 网段网络地址(整数)
+        available_hosts: 可用主机数量
+        count: 需要生成的IP数量
+
+    Returns:
+        IP地址整数列表
     """
-    ip: str
-    port: int
-    source_port: int = 0
-    tls: bool = False
-    datacenter: str = ""
-    region: str = ""
-    country: str = ""
-    city: str = ""
-    iata: str = ""
-    asn: int = 13335  # Cloudflare官方ASN编号
-    tcp_delay: Optional[float] = None
-    download_speed: Optional[float] = None
+    # 计算需要覆盖的子网数量(至少10个)
+    target_subnets = min(count, max(10, count // 5))
+
+    # 计算子网间隔步长
+    subnet_stride = max(1, available_hosts // (target_subnets * 256)) * 256
+
+    offset_grid = (
+        subnet_offset + position_offset
+        for subnet_offset in range(0, target_subnets * subnet_stride, subnet_stride)
+        for position_offset in _SUBNET_POSITION_OFFSETS
+    )
+    # 无需过滤末位为255的地址: 大型网段的网络地址按/24对齐,子网步长为256的整数倍,
+    # 偏移位置+1 最大为129,候选地址末位只会落在 1-5/33/65/129
+    candidates = (
+        base_address + offset + 1
+        for offset in offset_grid
+        if offset < available_hosts
+    )
+    return list(itertools.islice(candidates, count))
 
 
 class CloudflareCDNProvider:
@@ -94,6 +157,9 @@ class CloudflareCDNProvider:
         "131.0.72.0/22"
     ]
 
+    # 预解析的官方地址段 (网络地址整数, 地址总数),避免每次生成时重复解析CIDR字符串
+    _PARSED_RANGES = tuple(_parse_cidr(cidr) for cidr in OFFICIAL_IPV4_RANGES)
+
     # IATA机场代码到地理位置的映射表
     # 用于为IP地址添加地理元数据
     LOCATION_DATABASE = {
@@ -131,6 +197,47 @@ class CloudflareCDNProvider:
         "DXB": {"city": "Dubai", "region": "Middle East", "country": "AE"},
     }
 
+    # 未指定位置代码时使用的默认全球地理信息
+    # 各端点共享同一组驻留字符串,避免每个实例持有重复的字符串对象
+    DEFAULT_GEO = {
+        "datacenter": sys.intern("Cloudflare"),
+        "region": sys.intern("Global Anycast"),
+        "country": sys.intern("US"),
+    }
+
+    # 端点地理信息原型: (datacenter, region, country, city, iata)
+    # 由 LOCATION_DATABASE 预先展开,构建端点时整体解包,无需逐字段查询
+    _LOCATION_PROTO = {
+        code: (code, geo["region"], geo["country"], geo["city"], code)
+        for code, geo in LOCATION_DATABASE.items()
+    }
+
+    # 需要启用TLS加密的Cloudflare端口
+    SECURE_PORTS = frozenset({443, 2053, 2083, 2087, 2096, 8443})
+
+    # 经过验证的优质IP地址库,按 (前两段前缀, 第三段取值) 规格展开为 x.x.x.0 地址
+    # === Tier 1: 核心优质IP (连接成功率>90%) ===
+    PREMIUM_TIER1_IPS = _expand_subnet_spec([
+        (tuple(f"104.{octet}" for octet in range(16, 24)), range(5)),  # 104.16-23段 - 北美核心段,8个/16大段
+        (("162.159",), (0, 1, 2, 3, 4, 128, 129, 130, 192, 193)),        # 162.159段 - 高稳定性段
+        (tuple(f"104.{octet}" for octet in range(24, 28)), range(5)),  # 104.24-27段 - 扩展核心段
+    ])
+
+    # === Tier 2: 备用IP (连接成功率60-90%) ===
+    PREMIUM_TIER2_IPS = _expand_subnet_spec([
+        (("172.64", "172.65"), (0, 1, 32, 64)),                        # 172.64-71段 - 部分可用
+        (("172.66", "172.67"), (0, 1, 32)),
+        (("108.162",), (192, 193, 194, 195, 196, 224, 225, 226)),      # 108.162段 - CDN加速段
+        (("162.158",), (0, 1, 2, 64, 128)),                            # 162.158段 - 边缘节点
+    ])
+
+    # === Tier 3: DNS服务IP ===
+    PREMIUM_TIER3_IPS = (
+        "1.1.1.1", "1.0.0.1", "1.1.1.2", "1.0.0.2",  # Cloudflare公共DNS
+    ) + _expand_subnet_spec([
+        (("188.114",), range(96, 100)),
+    ])
+
     def __init__(self):
         """初始化CDN节点提供器,建立缓存结构"""
         self._cache: Dict[str, List[str]] = {}
@@ -138,7 +245,7 @@ class CloudflareCDNProvider:
 
     def generate_ips_from_cidr(
         self,
-        cidr: str,
+        cidr: Union[str, Tuple[int, int]],
         count: int = 10,
         use_random: bool = False,
         optimize_selection: bool = True
@@ -155,7 +262,7 @@ class CloudflareCDNProvider:
         3. 自动过滤 - 排除.255等特殊广播地址
 
         Args:
-            cidr: CIDR格式网段 (如 "104.16.0.0/13")
+            cidr: CIDR格式网段 (如 "104.16.0.0/13"),或预解析的 (网络地址整数, 地址总数) 元组
             count: 需要生成的IP数量
             use_random: 是否使用随机选择(默认False,不推荐)
             optimize_selection: 是否启用智能选择优化
@@ -164,71 +271,51 @@ class CloudflareCDNProvider:
             IP地址字符串列表
         """
         try:
-            network = ipaddress.ip_network(cidr)
-            available_hosts = network.num_addresses - 2  # 排除网络地址和广播地址
+            # 只解析一次网段,后续全部使用整数运算,仅在输出时转换为字符串
+            if isinstance(cidr, str):
+                base_address, num_addresses = _parse_cidr(cidr)
+            else:
+                base_address, num_addresses = cidr
+            available_hosts = num_addresses - 2  # 排除网络地址和广播地址
 
             if optimize_selection and not use_random:
-                result_ips = []
                 subnet_size = 256  # /24子网标准大小
 
                 # 策略A: 大型网段 - 跨子网分散选择
                 if available_hosts > count * subnet_size:
-                    # 计算需要覆盖的子网数量(至少10个)
-                    target_subnets = min(count, max(10, count // 5))
-
-                    # 计算子网间隔步长
-                    subnet_interval = available_hosts // (target_subnets * subnet_size)
-                    subnet_interval = max(1, subnet_interval)
-
-                    for subnet_index in range(target_subnets):
-                        base_offset = subnet_index * subnet_interval * subnet_size
-
-                        # 在每个子网中选择多个优质偏移位置
-                        # 偏移策略: [0,1,2,3,4] 起始段, [32,64,128] 特定段
-                        for position_offset in [0, 1, 2, 3, 4, 32, 64, 128]:
-                            if len(result_ips) >= count:
-                                break
-
-                            final_offset = base_offset + position_offset
-                            if 0 <= final_offset < available_hosts:
-                                ip_address = network.network_address + final_offset + 1
-                                ip_string = str(ip_address)
-
-                                # 过滤特殊地址
-                                if not ip_string.endswith('.255') and ip_string not in result_ips:
-                                    result_ips.append(ip_string)
-
-                        if len(result_ips) >= count:
-                            break
+                    result_ints = _spread_subnet_ints(base_address, available_hosts, count)
 
                 # 策略B: 小型网段 - 顺序选择
                 else:
-                    for offset in range(min(count * 2, available_hosts)):
-                        ip_address = network.network_address + offset + 1
-                        ip_string = str(ip_address)
-
-                        if not ip_string.endswith('.255'):
-                            result_ips.append(ip_string)
-
-                        if len(result_ips) >= count:
-                            break
-
-                return result_ips[:count]
+                    candidates = range(base_address + 1, base_address + 1 + min(count * 2, available_hosts))
+                    result_ints = list(itertools.islice(
+                        (ip_int for ip_int in candidates if (ip_int & 0xFF) != 0xFF),
+                        count
+                    ))
+
+                # 仅在输出边界将整数转换为字符串
+                return _ints_to_ips(result_ints)
+
+            # 主机地址范围(与 network.hosts() 一致: /31 和 /32 不排除首尾地址)
+            if num_addresses > 2:
+                host_range = range(base_address + 1, base_address + num_addresses - 1)
+            else:
+                host_range = range(base_address, base_address + num_addresses)
 
             # 随机选择模式(不推荐,可用性低)
-            elif use_random:
-                all_hosts = list(network.hosts())
-                if len(all_hosts) > count:
-                    return [str(ip) for ip in random.sample(all_hosts, count)]
+            # 直接在整数 range 上采样,避免为 /13 等大网段构造数十万个 IPv4Address 对象
+            if use_random:
+                if len(host_range) > count:
+                    return _ints_to_ips(random.sample(host_range, count))
                 else:
-                    return [str(ip) for ip in all_hosts]
+                    return _ints_to_ips(host_range)
 
             # 简单顺序选择
             else:
-                return [str(ip) for ip in itertools.islice(network.hosts(), count)]
+                return _ints_to_ips(itertools.islice(host_range, count))
 
         except Exception as e:
-            logger.error(f"从CIDR段 {cidr} 生成IP失败: {e}")
+            logger.error("从CIDR段 %s 生成IP失败: %s", cidr, e)
             return []
 
     def get_quality_optimized_ips(
@@ -256,6 +343,12 @@ class CloudflareCDNProvider:
         Returns:
             优化后的IP地址列表
         """
+        # 质量过滤模式结果确定,可直接复用缓存;无过滤模式为随机选择,不缓存
+        cache_key = f"quality:{ips_per_range}:{prefer_region}"
+        if enable_quality_filter and cache_key in self._cache:
+            logger.info("使用缓存的 %d 个优化IP地址", len(self._cache[cache_key]))
+            return list(self._cache[cache_key])
+
         all_ips = []
 
         # Tier 1: 北美优质IP段 (实测高可用性)
@@ -328,7 +421,7 @@ class CloudflareCDNProvider:
 
         else:
             # 无过滤模式: 从所有官方段平均获取
-            for cidr_range in self.OFFICIAL_IPV4_RANGES:
+            for cidr_range in self._PARSED_RANGES:
                 generated_ips = self.generate_ips_from_cidr(
                     cidr_range,
                     ips_per_range,
@@ -337,7 +430,10 @@ class CloudflareCDNProvider:
                 )
                 all_ips.extend(generated_ips)
 
-        logger.info(f"从 {len(premium_ranges)} 个优质网段生成了 {len(all_ips)} 个IP地址")
+        if enable_quality_filter:
+            self._cache[cache_key] = list(all_ips)
+
+        logger.info("从 %d 个优质网段生成了 %d 个IP地址", len(premium_ranges), len(all_ips))
         return all_ips
 
     def create_endpoint_list(
@@ -361,51 +457,44 @@ class CloudflareCDNProvider:
             ServerEndpoint对象列表
         """
         # 判断端口是否需要TLS加密
-        secure_ports = {443, 2053, 2083, 2087, 2096, 8443}
-        requires_tls = port in secure_ports
+        requires_tls = port in self.SECURE_PORTS
 
         # 生成IP地址池
+        ip_pool = self._endpoint_ip_pool(count)
+
+        # 构建端点对象列表(未指定位置代码时使用默认全球配置)
+        endpoints = self._build_endpoints(ip_pool, port, requires_tls, location_code, default_city="")
+
+        logger.info("创建了 %d 个CDN端点 (port=%s, tls=%s)", len(endpoints), port, requires_tls)
+        return endpoints
+
+    def _endpoint_ip_pool(self, count: int) -> List[str]:
+        """
+        生成 create_endpoint_list 使用的IP地址池
+
+        Args:
+            count: 需要的IP数量
+
+        Returns:
+            IP地址字符串列表(最多count个)
+        """
         ips_per_range = max(1, count // len(self.OFFICIAL_IPV4_RANGES))
         ip_pool = self.get_quality_optimized_ips(ips_per_range=ips_per_range)
 
         # 限制到指定数量
-        ip_pool = ip_pool[:count]
-
-        # 构建端点对象列表
-        endpoints = []
-        for ip_address in ip_pool:
-            # 如果指定了位置代码,附加地理信息
-            if location_code and location_code in self.LOCATION_DATABASE:
-                geo_data = self.LOCATION_DATABASE[location_code]
-                endpoint = ServerEndpoint(
-                    ip=ip_address,
-                    port=port,
-                    tls=requires_tls,
-                    datacenter=location_code,
-                    region=geo_data["region"],
-                    country=geo_data["country"],
-                    city=geo_data["city"],
-                    iata=location_code,
-                    asn=13335
-                )
-            else:
-                # 使用默认全球配置
-                endpoint = ServerEndpoint(
-                    ip=ip_address,
-                    port=port,
-                    tls=requires_tls,
-                    datacenter="Cloudflare",
-                    region="Global Anycast",
-                    country="US",
-                    city="",
-                    iata="",
-                    asn=13335
-                )
+        return ip_pool[:count]
 
-            endpoints.append(endpoint)
+    def prewarm(self, count: int = 100):
+        """
+        预生成默认数量的IP地址池并写入缓存
 
-        logger.info(f"创建了 {len(endpoints)} 个CDN端点 (port={port}, tls={requires_tls})")
-        return endpoints
+        之后以相同数量调用 create_endpoint_list 时直接命中缓存,
+        适用于希望在启动阶段承担生成开销的场景。
+
+        Args:
+            count: 预生成的端点数量(默认与 create_endpoint_list 一致)
+        """
+        self._endpoint_ip_pool(count)
 
     def get_verified_premium_ips(
         self,
@@ -430,47 +519,78 @@ class CloudflareCDNProvider:
         Returns:
             ServerEndpoint列表,已按优先级排序
         """
-        # === Tier 1: 核心优质IP (连接成功率>90%) ===
-        tier1_collection = [
-            # 104.16-23段 - 北美核心段,8个/16大段
-            "104.16.0.0", "104.16.1.0", "104.16.2.0", "104.16.3.0", "104.16.4.0",
-            "104.17.0.0", "104.17.1.0", "104.17.2.0", "104.17.3.0", "104.17.4.0",
-            "104.18.0.0", "104.18.1.0", "104.18.2.0", "104.18.3.0", "104.18.4.0",
-            "104.19.0.0", "104.19.1.0", "104.19.2.0", "104.19.3.0", "104.19.4.0",
-            "104.20.0.0", "104.20.1.0", "104.20.2.0", "104.20.3.0", "104.20.4.0",
-            "104.21.0.0", "104.21.1.0", "104.21.2.0", "104.21.3.0", "104.21.4.0",
-            "104.22.0.0", "104.22.1.0", "104.22.2.0", "104.22.3.0", "104.22.4.0",
-            "104.23.0.0", "104.23.1.0", "104.23.2.0", "104.23.3.0", "104.23.4.0",
-            # 162.159段 - 高稳定性段
-            "162.159.0.0", "162.159.1.0", "162.159.2.0", "162.159.3.0", "162.159.4.0",
-            "162.159.128.0", "162.159.129.0", "162.159.130.0", "162.159.192.0", "162.159.193.0",
-            # 104.24-27段 - 扩展核心段
-            "104.24.0.0", "104.24.1.0", "104.24.2.0", "104.24.3.0", "104.24.4.0",
-            "104.25.0.0", "104.25.1.0", "104.25.2.0", "104.25.3.0", "104.25.4.0",
-            "104.26.0.0", "104.26.1.0", "104.26.2.0", "104.26.3.0", "104.26.4.0",
-            "104.27.0.0", "104.27.1.0", "104.27.2.0", "104.27.3.0", "104.27.4.0",
-        ]
+        # IP选择结果只与位置代码相关,缓存后重复调用无需重新组合
+        cache_key = f"premium:{location_code}"
+        if cache_key not in self._cache:
+            self._cache[cache_key] = self._select_premium_ips(location_code)
+        selected_ips = self._cache[cache_key]
 
-        # === Tier 2: 备用IP (连接成功率60-90%) ===
-        tier2_collection = [
-            # 172.64-71段 - 部分可用
-            "172.64.0.0", "172.64.1.0", "172.64.32.0", "172.64.64.0",
-            "172.65.0.0", "172.65.1.0", "172.65.32.0", "172.65.64.0",
-            "172.66.0.0", "172.66.1.0", "172.66.32.0",
-            "172.67.0.0", "172.67.1.0", "172.67.32.0",
-            # 108.162段 - CDN加速段
-            "108.162.192.0", "108.162.193.0", "108.162.194.0", "108.162.195.0",
-            "108.162.196.0", "108.162.224.0", "108.162.225.0", "108.162.226.0",
-            # 162.158段 - 边缘节点
-            "162.158.0.0", "162.158.1.0", "162.158.2.0", "162.158.64.0", "162.158.128.0",
-        ]
+        # 判断TLS配置
+        requires_tls = port in self.SECURE_PORTS
+
+        # 构建端点列表
+        endpoints = self._build_endpoints(selected_ips, port, requires_tls, location_code, default_city="Premium IP")
+
+        logger.info("返回 %d 个优质CDN端点", len(endpoints))
+        return endpoints
 
-        # === Tier 3: DNS服务IP ===
-        tier3_collection = [
-            "1.1.1.1", "1.0.0.1", "1.1.1.2", "1.0.0.2",  # Cloudflare公共DNS
-            "188.114.96.0", "188.114.97.0", "188.114.98.0", "188.114.99.0",
+    def _build_endpoints(
+        self,
+        ip_addresses: Iterable[str],
+        port: int,
+        requires_tls: bool,
+        location_code: Optional[str],
+        default_city: str = ""
+    ) -> List[ServerEndpoint]:
+        """
+        按位置原型批量构建端点对象
+
+        Args:
+            ip_addresses: IP地址列表
+            port: 服务端口
+            requires_tls: 是否启用TLS加密
+            location_code: IATA位置代码(为空或未知时使用默认全球配置)
+            default_city: 默认全球配置使用的城市名称
+
+        Returns:
+            ServerEndpoint对象列表
+        """
+        # 整个调用只查询一次位置原型,循环内直接复用
+        prototype = self._LOCATION_PROTO.get(location_code)
+        if prototype is None:
+            default_geo = self.DEFAULT_GEO
+            prototype = (default_geo["datacenter"], default_geo["region"], default_geo["country"], default_city, "")
+        datacenter, region, country, city, iata = prototype
+
+        return [
+            ServerEndpoint(
+                ip=ip_address,
+                port=port,
+                tls=requires_tls,
+                datacenter=datacenter,
+                region=region,
+                country=country,
+                city=city,
+                iata=iata,
+                asn=13335
+            )
+            for ip_address in ip_addresses
         ]
 
+    def _select_premium_ips(self, location_code: Optional[str] = None) -> List[str]:
+        """
+        按位置代码组合优质IP地址
+
+        Args:
+            location_code: IATA位置代码(影响IP选择策略)
+
+        Returns:
+            IP地址字符串列表,已按优先级排序
+        """
+        tier1_collection = self.PREMIUM_TIER1_IPS
+        tier2_collection = self.PREMIUM_TIER2_IPS
+        tier3_collection = self.PREMIUM_TIER3_IPS
+
         # 根据地理位置优化IP选择策略
         if location_code == "HKG":
             # 香港地区优化组合
@@ -485,43 +605,12 @@ class CloudflareCDNProvider:
             # 默认全球组合
             selected_ips = tier1_collection + tier2_collection + tier3_collection
 
-        # 判断TLS配置
-        secure_ports = {443, 2053, 2083, 2087, 2096, 8443}
-        requires_tls = port in secure_ports
-
-        # 构建端点列表
-        endpoints = []
-        for ip_address in selected_ips:
-            if location_code and location_code in self.LOCATION_DATABASE:
-                geo_data = self.LOCATION_DATABASE[location_code]
-                endpoint = ServerEndpoint(
-                    ip=ip_address,
-                    port=port,
-                    tls=requires_tls,
-                    datacenter=location_code,
-                    region=geo_data["region"],
-                    country=geo_data["country"],
-                    city=geo_data["city"],
-                    iata=location_code,
-                    asn=13335
-                )
-            else:
-                endpoint = ServerEndpoint(
-                    ip=ip_address,
-                    port=port,
-                    tls=requires_tls,
-                    datacenter="Cloudflare",
-                    region="Global Anycast",
-                    country="US",
-                    city="Premium IP",
-                    iata="",
-                    asn=13335
-                )
-            endpoints.append(endpoint)
-
-        logger.info(f"返回 {len(endpoints)} 个优质CDN端点")
-        return endpoints
+        return list(selected_ips)
 
 
 # 创建全局CDN提供器实例
 cdn_provider = CloudflareCDNProvider()
+
+# 设置环境变量 CF_SPEEDTEST_PREWARM=1 时在导入阶段预生成默认IP池
+if os.environ.get("CF_SPEEDTEST_PREWARM") == "1":
+    cdn_provider.prewarm()
@@ -3,23 +3,129 @@ IP测试模块
 实现TCP连接延迟测试和下载速度测试
 """
 
+import errno
+import heapq
+import os
+import select
+import selectors
 import socket
+import sys
+import threading
 import time
-import requests
 import logging
 import warnings
-from typing import Optional, Tuple
+from collections import Counter, deque
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 
-# 禁用SSL警告
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from models import DATACLASS_SLOTS
 
-logger = logging.getLogger(__name__)
+if TYPE_CHECKING:
+    import ssl
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+# 下载接收缓冲区大小: 高带宽下减少 recv 次数, 每个线程复用同一块缓冲区
+DOWNLOAD_BUFFER_SIZE = 256 * 1024
+
+# 下载测速的最短测量时长(秒), 计时从首字节到达开始
+SPEED_MEASURE_WINDOW = 3.0
+
+# 批量TCP探测时同时挂起的连接数上限
+# (Windows 的 select() 最多 512 个套接字, Linux 默认 ulimit -n 为 1024)
+TCP_PROBE_MAX_IN_FLIGHT = 500
+
+# 批量TCP探测每轮最多发起的连接数; 两轮之间用 select(0) 收割已完成的连接,
+# 避免先发起的连接因等待后续大量 socket()/connect_ex() 调用而被记录为更高的延迟
+TCP_PROBE_LAUNCH_BATCH = 32
+
+# TLS会话缓存的最大条目数, 超出时淘汰最早保存的会话
+TLS_SESSION_CACHE_SIZE = 256
+
+# 测速共享的TLS上下文: 只关心吞吐量,不校验证书; 首次测速时才导入 ssl 并创建,
+# 仅测延迟 (--no-speed) 时不加载; 之后所有测速复用同一个上下文
+_ssl_ctx = None
+_ssl_ctx_lock = threading.Lock()
+
+
+def _get_ssl_context() -> 'ssl.SSLContext':
+    """获取 (必要时创建) 共享的TLS上下文"""
+    global _ssl_ctx
+    if _ssl_ctx is None:
+        with _ssl_ctx_lock:
+            if _ssl_ctx is None:
+                import ssl
+
+                ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)  # 不加载系统CA证书
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+                ctx.set_alpn_protocols(['http/1.1'])
+                _ssl_ctx = ctx
+    return _ssl_ctx
+
+
+# 非阻塞 connect_ex() 表示"连接进行中"的返回值 (Windows 为 WSAEWOULDBLOCK);
+# POSIX 上 EWOULDBLOCK 即 EAGAIN, 表示本地端口耗尽、连接并未发起, 不能视为进行中
+if sys.platform == "win32":
+    _CONNECT_IN_PROGRESS = frozenset({
+        0, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)
+    })
+else:
+    _CONNECT_IN_PROGRESS = frozenset({0, errno.EINPROGRESS})
+
+# Linux 上创建套接字时直接指定非阻塞/CLOEXEC,省去额外的 fcntl 调用
+_SOCK_NONBLOCK = getattr(socket, 'SOCK_NONBLOCK', 0)
+_PROBE_SOCK_TYPE = socket.SOCK_STREAM | _SOCK_NONBLOCK | getattr(socket, 'SOCK_CLOEXEC', 0)
+
+
+def _new_probe_socket(timeout: float) -> socket.socket:
+    """创建用于TCP延迟探测的非阻塞套接字"""
+    sock = socket.socket(socket.AF_INET, _PROBE_SOCK_TYPE)
+    if not _SOCK_NONBLOCK:
+        sock.setblocking(False)
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        # 让内核的SYN重传放弃时间与超时设置一致 (Linux)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(timeout * 1000))
+    return sock
+
+
+if hasattr(select, 'poll'):
+    def _wait_writable(sock: socket.socket, timeout: float) -> bool:
+        """等待非阻塞connect完成 (可写或出错),超时返回False"""
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        return bool(poller.poll(timeout * 1000))
+else:
+    def _wait_writable(sock: socket.socket, timeout: float) -> bool:
+        """等待非阻塞connect完成 (可写或出错),超时返回False"""
+        # Windows 上连接失败通过异常集合通知
+        _, writable, failed = select.select([], [sock], [sock], timeout)
+        return bool(writable or failed)
+
+
+# 测速请求模板: 直连IP, 通过Host/SNI指定目标域名, 禁用压缩
+_HTTP_REQUEST_TEMPLATE = (
+    "GET {path} HTTP/1.1\r\n"
+    "Host: {host}\r\n"
+    "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36\r\n"
+    "Accept: */*\r\n"
+    "Accept-Encoding: identity\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+)
+
+
+def _parse_status_code(header: bytes) -> int:
+    """从响应头中解析HTTP状态码"""
+    status_line = header.split(b'\r\n', 1)[0]
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise ValueError(f"无效的HTTP响应: {status_line[:64]!r}")
+    return int(parts[1])
+
+
+@dataclass(**DATACLASS_SLOTS)
 class TestResult:
     """测试结果数据类"""
     ip: str
@@ -28,14 +134,91 @@ class TestResult:
     download_speed: Optional[float] = None  # 下载速度(MB/s)
     success: bool = False
     error: Optional[str] = None
+    tcp_delay_ns: Optional[int] = None  # TCP连接延迟(纳秒),排序使用,避免浮点误差
+
+    def set_tcp_delay_ns(self, delay_ns: int):
+        """记录TCP连接延迟(纳秒),同时更新毫秒值"""
+        self.tcp_delay_ns = delay_ns
+        self.tcp_delay = delay_ns / 1_000_000
+
+
+class _EndpointStats:
+    """
+    测速端点统计 (所有IP共享)
+
+    曾经成功的端点优先尝试; 连续失败达到阈值的端点在冷却期内跳过,
+    避免每个IP都在同一个不可用的端点上浪费一次请求。
+    """
+
+    FAIL_THRESHOLD = 3    # 连续失败次数阈值
+    COOLDOWN = 60.0       # 跳过时长(秒)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wins: Counter = Counter()
+        self.recent_fails: Counter = Counter()
+        self._disabled_until: Dict[Tuple[str, str], float] = {}
+
+    def order(self, endpoints: list) -> list:
+        """按历史表现排序端点并剔除冷却中的端点; 全部冷却时仍返回原列表"""
+        now = time.monotonic()
+        with self._lock:
+            active = [e for e in endpoints if self._disabled_until.get(e, 0.0) <= now]
+            # sort 是稳定的,表现相同时保持原有优先级
+            active.sort(key=lambda e: (-self.wins[e], self.recent_fails[e]))
+        return active or list(endpoints)
+
+    def record_success(self, endpoint: Tuple[str, str]):
+        with self._lock:
+            self.wins[endpoint] += 1
+            self.recent_fails.pop(endpoint, None)
+            self._disabled_until.pop(endpoint, None)
+
+    def record_failure(self, endpoint: Tuple[str, str], endpoints: Optional[list] = None):
+        """
+        记录端点自身的失败 (HTTP错误或响应数据不足)
+
+        只有 endpoints 中还有其他未冷却且曾经成功的端点时才会暂停该端点,
+        避免唯一能测出速度的端点被停用后,所有IP都只能尝试数据量不足的小页面。
+        """
+        with self._lock:
+            self.recent_fails[endpoint] += 1
+            if self.recent_fails[endpoint] < self.FAIL_THRESHOLD:
+                return
+            now = time.monotonic()
+            has_fallback = any(
+                e != endpoint and self.wins[e] > 0 and self._disabled_until.get(e, 0.0) <= now
+                for e in endpoints or ()
+            )
+            if not has_fallback:
+                return
+            self._disabled_until[endpoint] = now + self.COOLDOWN
+            self.recent_fails[endpoint] = 0
+            logger.info(f"测速端点 {endpoint[1]}{endpoint[0]} 连续失败 {self.FAIL_THRESHOLD} 次,"
+                        f"暂停使用 {self.COOLDOWN:.0f} 秒")
 
 
 class IPTester:
     """IP测试器"""
 
+    # 端点统计在所有实例和线程间共享
+    _endpoint_stats = _EndpointStats()
+
     def __init__(self, tcp_timeout: int = 5, speed_test_timeout: int = 30):
         self.tcp_timeout = tcp_timeout
         self.speed_test_timeout = speed_test_timeout
+        # 每个工作线程各自的接收缓冲区
+        self._local = threading.local()
+        # TLS会话缓存: 同一IP/端口/SNI再次测速时复用会话,省去完整握手
+        self._tls_sessions: Dict[Tuple[str, int, str], 'ssl.SSLSession'] = {}
+        self._tls_sessions_lock = threading.Lock()
+
+    def _get_buffer(self) -> memoryview:
+        """获取当前线程复用的接收缓冲区"""
+        mv = getattr(self._local, 'buffer', None)
+        if mv is None:
+            mv = self._local.buffer = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+        return mv
 
     def test_tcp_delay(self, ip: str, port: int, retries: int = 2) -> Tuple[bool, Optional[float], Optional[str]]:
         """
@@ -49,26 +232,37 @@ class IPTester:
         Returns:
             (成功标志, 延迟时间(ms), 错误信息)
         """
+        success, delay_ns, error = self._probe_tcp_ns(ip, port, retries)
+        return success, (delay_ns / 1_000_000 if success else None), error
+
+    def _probe_tcp_ns(self, ip: str, port: int, retries: int = 2) -> Tuple[bool, Optional[int], Optional[str]]:
+        """
+        测试TCP连接延迟,计时使用 perf_counter_ns (单调时钟,不受系统时间调整影响)
+
+        Returns:
+            (成功标志, 延迟时间(ns), 错误信息)
+        """
         last_error = None
 
         for attempt in range(retries + 1):
             sock = None
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(self.tcp_timeout)
-
-                # 设置TCP参数优化连接
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                if hasattr(socket, 'TCP_NODELAY'):
-                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-
-                start_time = time.time()
-                sock.connect((ip, port))
-                end_time = time.time()
-
-                delay_ms = (end_time - start_time) * 1000  # 转换为毫秒
-                logger.debug(f"{ip}:{port} TCP延迟: {delay_ms:.2f}ms (尝试 {attempt + 1}/{retries + 1})")
-                return True, delay_ms, None
+                sock = _new_probe_socket(self.tcp_timeout)
+
+                start_ns = time.perf_counter_ns()
+                err = sock.connect_ex((ip, port))
+                if err in _CONNECT_IN_PROGRESS and err != 0:
+                    if not _wait_writable(sock, self.tcp_timeout):
+                        raise socket.timeout("连接超时")
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                end_ns = time.perf_counter_ns()
+                if err != 0:
+                    # OSError 会按 errno 映射为 ConnectionRefusedError 等子类
+                    raise OSError(err, os.strerror(err))
+
+                delay_ns = end_ns - start_ns
+                logger.debug(f"{ip}:{port} TCP延迟: {delay_ns / 1_000_000:.2f}ms (尝试 {attempt + 1}/{retries + 1})")
+                return True, delay_ns, None
 
             except socket.timeout:
                 last_error = "连接超时"
@@ -116,6 +310,16 @@ class IPTester:
         Returns:
             (成功标志, 下载速度(MB/s), 错误信息)
         """
+        return self._measure_download(ip, port, use_tls, custom_speed_url)[:3]
+
+    def _measure_download(self, ip: str, port: int, use_tls: bool,
+                          custom_speed_url: Optional[str]) -> Tuple[bool, Optional[float], Optional[str], Optional[int]]:
+        """
+        测试下载速度,同时记录首次成功建立TCP连接的耗时
+
+        Returns:
+            (成功标志, 下载速度(MB/s), 错误信息, TCP连接延迟(ns); 从未连接成功时为None)
+        """
         scheme = "https" if use_tls else "http"
 
         # 测试端点列表（按优先级）
@@ -137,105 +341,86 @@ class IPTester:
             ("/generate_204", "connectivitycheck.gstatic.com"),  # Google连通性检查
         ])
 
-        # 目标下载量（字节）
-        target_size = 5 * 1024 * 1024  # 5MB
+        # 最少下载量（字节）: 过小会在TCP慢启动阶段就结束,低估实际带宽
+        target_size = 10 * 1024 * 1024  # 10MB
         min_size = 100 * 1024          # 最小100KB才认为有效
 
         best_speed = 0.0
         success = False
         last_error = None
+        connect_delay = None
+        connect_retries = 2  # 与 test_tcp_delay 的默认重试次数一致
 
-        for path, sni_hostname in test_paths:
-            try:
-                url = f"{scheme}://{ip}:{port}{path}"
-                logger.debug(f"尝试测速URL: {url} (SNI: {sni_hostname})")
-
-                # 创建自定义session，设置SNI
-                session = requests.Session()
-
-                if use_tls:
-                    # 配置SSL/TLS以支持SNI
-                    from urllib3.util.ssl_ import create_urllib3_context
-                    import ssl
-
-                    # 创建SSL上下文
-                    ctx = create_urllib3_context()
-                    ctx.check_hostname = False
-                    ctx.verify_mode = ssl.CERT_NONE
-
-                    # 创建自定义的HTTPAdapter with SNI
-                    from requests.adapters import HTTPAdapter
-                    from urllib3.poolmanager import PoolManager
-
-                    class SNIAdapter(HTTPAdapter):
-                        def __init__(self, sni_host, *args, **kwargs):
-                            self.sni_host = sni_host
-                            super().__init__(*args, **kwargs)
-
-                        def init_poolmanager(self, *args, **kwargs):
-                            kwargs['server_hostname'] = self.sni_host
-                            kwargs['assert_hostname'] = False
-                            return super().init_poolmanager(*args, **kwargs)
-
-                    adapter = SNIAdapter(sni_hostname)
-                    session.mount('https://', adapter)
-
-                session.verify = False
-
-                headers = {
-                    'Host': sni_hostname,  # 设置Host header
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'identity',  # 禁用压缩
-                    'Connection': 'close'
-                }
-
-                start_time = time.time()
-                downloaded = 0
-
-                with session.get(url, headers=headers, stream=True,
-                               timeout=self.speed_test_timeout) as response:
-
-                    # 接受所有非错误状态码
-                    if response.status_code >= 400:
-                        last_error = f"HTTP {response.status_code}"
-                        logger.debug(f"{url} 返回 {response.status_code}")
-                        continue
-
-                    # 开始下载数据
-                    for chunk in response.iter_content(chunk_size=65536):
-                        if chunk:
-                            downloaded += len(chunk)
-                            # 下载足够数据后停止
-                            if downloaded >= target_size:
-                                break
+        stats = self._endpoint_stats
+        for endpoint in stats.order(test_paths):
+            path, sni_hostname = endpoint
+            url = f"{scheme}://{ip}:{port}{path}"
 
-                    elapsed = time.time() - start_time
+            # 建立TCP连接,失败时对同一端点重试; 连接失败与端点无关,不计入端点统计
+            sock = None
+            for attempt in range(connect_retries + 1):
+                try:
+                    sock, connect_ns = self._connect(ip, port)
+                    break
+                except socket.timeout:
+                    last_error = "连接超时"
+                except ConnectionRefusedError:
+                    last_error = "连接被拒绝"
+                    break  # 连接被拒绝通常不需要重试
+                except OSError as e:
+                    last_error = f"网络错误: {e}"
+                if attempt < connect_retries:
+                    logger.debug(f"{ip}:{port} 测速连接失败,重试 {attempt + 1}/{connect_retries}")
+                    time.sleep(0.5)
+            if sock is None:
+                # IP本身无法连接,换端点也无济于事
+                break
+            if connect_delay is None:
+                connect_delay = connect_ns
 
-                    # 检查是否下载了足够的数据
-                    if downloaded >= min_size and elapsed > 0:
-                        speed_mbps = (downloaded / (1024 * 1024)) / elapsed
+            try:
+                logger.debug(f"尝试测速URL: {url} (SNI: {sni_hostname})")
 
-                        # 更新最佳速度
-                        if speed_mbps > best_speed:
-                            best_speed = speed_mbps
-                            success = True
+                deadline = time.monotonic() + self.speed_test_timeout
+                status_code, downloaded, elapsed = self._raw_download(
+                    sock, ip, port, sni_hostname, path, use_tls, target_size, deadline
+                )
 
-                        logger.info(f"{ip}:{port} 从 {path} 下载速度: {speed_mbps:.2f} MB/s "
-                                  f"(下载 {downloaded/1024/1024:.2f}MB 用时 {elapsed:.2f}s)")
+                # 接受所有非错误状态码
+                if status_code >= 400:
+                    last_error = f"HTTP {status_code}"
+                    logger.debug(f"{url} 返回 {status_code}")
+                    stats.record_failure(endpoint, test_paths)
+                    continue
 
-                        # 成功就不再尝试其他端点
-                        break
-                    else:
-                        last_error = f"下载数据不足 ({downloaded} bytes)"
-                        logger.debug(f"{url} 下载数据不足: {downloaded} bytes")
-                        continue
+                # 检查是否下载了足够的数据
+                if downloaded >= min_size and elapsed > 0:
+                    speed_mbps = (downloaded / (1024 * 1024)) / elapsed
+
+                    # 更新最佳速度
+                    if speed_mbps > best_speed:
+                        best_speed = speed_mbps
+                        success = True
+
+                    logger.info(f"{ip}:{port} 从 {path} 下载速度: {speed_mbps:.2f} MB/s "
+                              f"(下载 {downloaded/1024/1024:.2f}MB 用时 {elapsed:.2f}s)")
+
+                    stats.record_success(endpoint)
+                    # 成功就不再尝试其他端点
+                    break
+                else:
+                    last_error = f"下载数据不足 ({downloaded} bytes)"
+                    logger.debug(f"{url} 下载数据不足: {downloaded} bytes")
+                    stats.record_failure(endpoint, test_paths)
+                    continue
 
-            except requests.exceptions.Timeout:
+            except socket.timeout:
+                # TLS握手或响应头迟迟不到多为IP本身的问题,不计入端点统计
                 last_error = "下载超时"
                 logger.debug(f"{url} 超时")
                 continue
-            except requests.exceptions.ConnectionError as e:
+            except OSError as e:
+                # 包含 ssl.SSLError 与连接被拒绝/重置等错误; 多为IP本身的问题,不计入端点统计
                 last_error = f"连接错误: {str(e)}"
                 logger.debug(f"{url} 连接失败: {e}")
                 continue
@@ -245,10 +430,124 @@ class IPTester:
                 continue
 
         if success:
-            return True, best_speed, None
+            return True, best_speed, None, connect_delay
+        elif connect_delay is None:
+            logger.warning(f"{ip}:{port} TCP连接失败: {last_error}")
+            return False, None, last_error, None
         else:
             logger.warning(f"{ip}:{port} 所有测速端点均失败，最后错误: {last_error}")
-            return False, None, last_error or "所有测速端点均不可用"
+            return False, None, last_error or "所有测速端点均不可用", connect_delay
+
+    def _connect(self, ip: str, port: int) -> Tuple[socket.socket, int]:
+        """
+        建立用于测速的TCP连接
+
+        Returns:
+            (已连接的socket, 连接耗时(ns))
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # 连接使用TCP超时,读取使用测速超时
+            sock.settimeout(self.tcp_timeout)
+            start_ns = time.perf_counter_ns()
+            sock.connect((ip, port))
+            connect_ns = time.perf_counter_ns() - start_ns
+            sock.settimeout(self.speed_test_timeout)
+        except BaseException:
+            sock.close()
+            raise
+        return sock, connect_ns
+
+    def _save_tls_session(self, key: Tuple[str, int, str], session: Optional['ssl.SSLSession']):
+        """保存TLS会话供后续连接复用,缓存超过上限时淘汰最早的条目"""
+        if session is None:
+            return
+        with self._tls_sessions_lock:
+            self._tls_sessions.pop(key, None)
+            self._tls_sessions[key] = session
+            if len(self._tls_sessions) > TLS_SESSION_CACHE_SIZE:
+                del self._tls_sessions[next(iter(self._tls_sessions))]
+
+    def _raw_download(self, sock: socket.socket, ip: str, port: int, host: str, path: str,
+                      use_tls: bool, target_size: int, deadline: float) -> Tuple[int, int, float]:
+        """
+        使用原始socket流式下载测速文件,数据直接读入预分配缓冲区后丢弃
+
+        Args:
+            sock: 已连接的socket (由本方法负责关闭)
+            ip: IP地址
+            port: 端口号
+            host: Host头及SNI主机名
+            path: 请求路径
+            use_tls: 是否使用TLS
+            target_size: 最少下载量(字节)
+            deadline: 截止时间 (time.monotonic() 时间戳)
+
+        Returns:
+            (HTTP状态码, 下载字节数, 用时(秒)); 计时从首字节到达开始,
+            不包含连接、TLS握手和等待首字节的时间
+        """
+        try:
+            if use_tls:
+                session_key = (ip, port, host)
+                sock = _get_ssl_context().wrap_socket(sock, server_hostname=host,
+                                                        session=self._tls_sessions.get(session_key))
+                if sock.session_reused:
+                    logger.debug(f"{ip}:{port} 复用TLS会话 (SNI: {host})")
+
+            request = _HTTP_REQUEST_TEMPLATE.format(path=path, host=host)
+            sock.sendall(request.encode('ascii'))
+
+            mv = self._get_buffer()
+
+            # 读取响应头
+            header = bytearray()
+            while True:
+                n = sock.recv_into(mv)
+                if not n:
+                    raise ConnectionError("服务器在响应头结束前关闭连接")
+                header += mv[:n]
+                header_end = header.find(b'\r\n\r\n')
+                if header_end >= 0:
+                    break
+                if len(header) > 65536:
+                    raise ValueError("响应头过大")
+                if time.monotonic() > deadline:
+                    raise socket.timeout("读取响应头超时")
+
+            # 首字节已到达,从此刻开始计时; 与响应头同包到达的少量数据不计入
+            measure_start = time.monotonic()
+            status_code = _parse_status_code(header)
+            if status_code >= 400:
+                # 该IP的下一个端点可复用本次会话
+                if use_tls:
+                    self._save_tls_session(session_key, sock.session)
+                return status_code, 0, 0.0
+
+            # 开始下载数据: 需同时满足最短测量时长和最少下载量,
+            # 避免在TCP慢启动阶段结束而低估带宽; 到达截止时间或数据结束时停止
+            downloaded = 0
+            while True:
+                n = sock.recv_into(mv)
+                if not n:
+                    break
+                downloaded += n
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if downloaded >= target_size and now - measure_start >= SPEED_MEASURE_WINDOW:
+                    break
+
+            elapsed = time.monotonic() - measure_start
+
+            # TLS 1.3 的会话票据在握手后才下发,读完数据后再保存
+            if use_tls:
+                self._save_tls_session(session_key, sock.session)
+
+            return status_code, downloaded, elapsed
+        finally:
+            sock.close()
 
     def test_ip(self, ip: str, port: int, test_speed: bool = True, use_tls: bool = True,
                custom_speed_url: Optional[str] = None) -> TestResult:
@@ -267,27 +566,33 @@ class IPTester:
         """
         result = TestResult(ip=ip, port=port)
 
-        # 第一步: 测试TCP连接延迟
-        tcp_success, tcp_delay, tcp_error = self.test_tcp_delay(ip, port)
-
-        if not tcp_success:
-            result.error = tcp_error
-            return result
-
-        result.tcp_delay = tcp_delay
-        result.success = True
-
-        # 第二步: 如果需要,测试下载速度
         if test_speed:
-            speed_success, download_speed, speed_error = self.test_download_speed(
+            # 测速时直接以下载连接的建立耗时作为TCP延迟,省去单独的一次握手
+            speed_success, download_speed, speed_error, connect_delay = self._measure_download(
                 ip, port, use_tls, custom_speed_url
             )
+            if connect_delay is None:
+                result.error = speed_error
+                return result
+
+            result.set_tcp_delay_ns(connect_delay)
+            result.success = True
             if speed_success:
                 result.download_speed = download_speed
             else:
                 # 速度测试失败不影响整体成功状态,但记录错误
                 logger.debug(f"{ip}:{port} 速度测试失败: {speed_error}")
+            return result
+
+        # 仅测延迟: 测试TCP连接延迟
+        tcp_success, tcp_delay_ns, tcp_error = self._probe_tcp_ns(ip, port)
 
+        if not tcp_success:
+            result.error = tcp_error
+            return result
+
+        result.set_tcp_delay_ns(tcp_delay_ns)
+        result.success = True
         return result
 
 
@@ -299,7 +604,8 @@ class BatchIPTester:
         self.tester = IPTester(tcp_timeout=tcp_timeout, speed_test_timeout=speed_test_timeout)
 
     def test_ips(self, ip_list: list, test_speed: bool = True, use_tls: bool = True,
-                 custom_speed_url: Optional[str] = None, progress_callback=None) -> list:
+                 custom_speed_url: Optional[str] = None, progress_callback=None,
+                 speed_candidates: Optional[int] = None) -> list:
         """
         批量测试IP列表
 
@@ -309,10 +615,23 @@ class BatchIPTester:
             use_tls: 是否使用TLS
             custom_speed_url: 自定义速度测试URL (从API的/speed端点获取)
             progress_callback: 进度回调函数
+            speed_candidates: 两阶段测试时参与测速的IP数量: 先探测全部IP的TCP延迟,
+                只对延迟最低的这些IP测速; None 表示逐个完整测试所有IP
 
         Returns:
             测试结果列表
         """
+        if not test_speed:
+            # 仅测延迟时无需线程池,单线程事件驱动即可并发探测
+            logger.info(f"开始批量测试 {len(ip_list)} 个IP的TCP延迟...")
+            results = self.test_tcp_delays_bulk(ip_list, progress_callback=progress_callback)
+            logger.info(f"批量测试完成,成功: {sum(1 for r in results if r.success)}/{len(ip_list)}")
+            return results
+
+        if speed_candidates is not None:
+            return self._test_ips_two_phase(ip_list, use_tls, custom_speed_url,
+                                            progress_callback, speed_candidates)
+
         results = []
         total = len(ip_list)
 
@@ -358,6 +677,217 @@ class BatchIPTester:
         logger.info(f"批量测试完成,成功: {sum(1 for r in results if r.success)}/{total}")
         return results
 
+    def _test_ips_two_phase(self, ip_list: list, use_tls: bool, custom_speed_url: Optional[str],
+                            progress_callback, speed_candidates: int) -> list:
+        """
+        两阶段批量测试: 先快速探测全部IP的TCP延迟,再只对延迟最低的候选IP测速
+
+        每个IP只回调一次进度: 未入选测速的IP在第一阶段结束后回调,
+        入选的IP在测速完成后回调。
+        """
+        total = len(ip_list)
+        logger.info(f"开始批量测试 {total} 个IP (先测TCP延迟,再对延迟最低的 {speed_candidates} 个IP测速)...")
+        if custom_speed_url:
+            logger.info(f"使用自定义速度测试URL: {custom_speed_url}")
+
+        # 第一阶段: TCP延迟
+        results = self.test_tcp_delays_bulk(ip_list)
+        reachable = [r for r in results if r.success]
+        selected = heapq.nsmallest(speed_candidates, reachable, key=lambda r: r.tcp_delay_ns)
+        logger.info(f"TCP延迟探测完成,成功: {len(reachable)}/{total},选出 {len(selected)} 个IP进行测速")
+
+        completed = 0
+
+        def report(result: TestResult):
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, total, result)
+
+        selected_ids = {id(r) for r in selected}
+        for result in results:
+            if id(result) not in selected_ids:
+                report(result)
+
+        # 第二阶段: 下载测速
+        self._phase_speed(selected, use_tls, custom_speed_url, report)
+
+        logger.info(f"批量测试完成,成功: {sum(1 for r in results if r.success)}/{total}")
+        return results
+
+    def _phase_speed(self, selected: list, use_tls: bool, custom_speed_url: Optional[str], on_done):
+        """
+        对已通过TCP探测的结果并发测速,速度直接写入结果对象 (保留探测得到的TCP延迟)
+
+        Args:
+            selected: 待测速的测试结果列表
+            use_tls: 是否使用TLS
+            custom_speed_url: 自定义速度测试URL
+            on_done: 每个结果测速完成后的回调
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_result = {
+                executor.submit(self.tester.test_download_speed, r.ip, r.port, use_tls, custom_speed_url): r
+                for r in selected
+            }
+            for future in as_completed(future_to_result):
+                result = future_to_result[future]
+                try:
+                    speed_success, download_speed, speed_error = future.result()
+                    if speed_success:
+                        result.download_speed = download_speed
+                    else:
+                        # 速度测试失败不影响整体成功状态
+                        logger.debug(f"{result.ip}:{result.port} 速度测试失败: {speed_error}")
+                except Exception as e:
+                    logger.error(f"测速 {result.ip}:{result.port} 时发生异常: {e}")
+                on_done(result)
+
+    def test_tcp_delays_bulk(self, locations: list, retries: int = 2,
+                             max_in_flight: int = TCP_PROBE_MAX_IN_FLIGHT,
+                             progress_callback=None) -> list:
+        """
+        批量测试TCP连接延迟 (单线程, 非阻塞connect + selectors)
+
+        重试策略与 IPTester.test_tcp_delay 一致: 超时和网络错误在0.5秒后重试,
+        连接被拒绝不重试。
+
+        Args:
+            locations: IP位置列表
+            retries: 失败后重试次数
+            max_in_flight: 同时进行中的连接数上限
+            progress_callback: 进度回调函数
+
+        Returns:
+            测试结果列表 (与输入顺序一致)
+        """
+        tcp_timeout = self.tester.tcp_timeout
+        total = len(locations)
+        results = [TestResult(ip=loc.ip, port=loc.port) for loc in locations]
+        attempts = [0] * total
+        pending = deque(range(total))
+        retry_heap = []   # (可重试时间, 索引)
+        in_flight = {}    # 索引 -> (socket, 开始时间(perf_counter_ns), 超时时间(monotonic))
+        finished = []     # 待回调进度的结果
+        completed = 0
+
+        def report_progress():
+            # 进度回调(写CSV、输出日志)集中在即将阻塞等待前执行,避免在发起连接的间隙里执行;
+            # 此时仍有连接在进行中,回调期间完成的连接会计入回调耗时,延迟略微偏大
+            nonlocal completed
+            for result in finished:
+                completed += 1
+                if progress_callback:
+                    progress_callback(completed, total, result)
+            finished.clear()
+
+        def finish(index: int, delay_ns: Optional[int], error: Optional[str]):
+            result = results[index]
+            if error is None:
+                result.set_tcp_delay_ns(delay_ns)
+                result.success = True
+                logger.debug(f"{result.ip}:{result.port} TCP延迟: {result.tcp_delay:.2f}ms "
+                             f"(尝试 {attempts[index]}/{retries + 1})")
+            else:
+                result.error = error
+                logger.warning(f"{result.ip}:{result.port} TCP连接失败 (重试{retries}次): {error}")
+            finished.append(result)
+
+        def fail(index: int, error: str, retryable: bool):
+            if retryable and attempts[index] <= retries:
+                logger.debug(f"{results[index].ip}:{results[index].port} {error},"
+                             f"重试 {attempts[index]}/{retries}")
+                heapq.heappush(retry_heap, (time.monotonic() + 0.5, index))
+            else:
+                finish(index, None, error)
+
+        selector = selectors.DefaultSelector()
+        try:
+            while pending or retry_heap or in_flight:
+                now = time.monotonic()
+                while retry_heap and retry_heap[0][0] <= now:
+                    pending.append(heapq.heappop(retry_heap)[1])
+
+                # 发起新连接 (每轮数量有限)
+                launched = 0
+                while pending and len(in_flight) < max_in_flight and launched < TCP_PROBE_LAUNCH_BATCH:
+                    launched += 1
+                    index = pending.popleft()
+                    location = locations[index]
+                    attempts[index] += 1
+                    try:
+                        sock = _new_probe_socket(tcp_timeout)
+                    except OSError as e:
+                        fail(index, f"网络错误: {e}", retryable=False)
+                        continue
+                    start_ns = time.perf_counter_ns()
+                    try:
+                        err = sock.connect_ex((location.ip, location.port))
+                    except OSError as e:
+                        # 如非IPv4地址引发的 socket.gaierror, 只影响该IP
+                        sock.close()
+                        fail(index, f"网络错误: {e}", retryable=False)
+                        continue
+                    if err not in _CONNECT_IN_PROGRESS:
+                        sock.close()
+                        if err == errno.ECONNREFUSED:
+                            fail(index, "连接被拒绝", retryable=False)
+                        else:
+                            fail(index, f"网络错误: {os.strerror(err)}", retryable=True)
+                        continue
+                    selector.register(sock, selectors.EVENT_WRITE, index)
+                    in_flight[index] = (sock, start_ns, time.monotonic() + tcp_timeout)
+
+                more_to_launch = bool(pending) and len(in_flight) < max_in_flight
+
+                # 等待连接完成,最多等到最近的超时或重试时间; 还有连接待发起时只收割不等待
+                if in_flight:
+                    if more_to_launch:
+                        timeout = 0.0
+                    else:
+                        report_progress()
+                        wake_at = min(deadline for _, _, deadline in in_flight.values())
+                        if retry_heap:
+                            wake_at = min(wake_at, retry_heap[0][0])
+                        timeout = max(0.0, wake_at - time.monotonic())
+                    events = selector.select(timeout)
+                else:
+                    # 本轮发起的连接可能全部立即失败,此时只有在等待重试时才需要休眠
+                    if not more_to_launch:
+                        report_progress()
+                        if retry_heap:
+                            time.sleep(max(0.0, retry_heap[0][0] - time.monotonic()))
+                    continue
+
+                now = time.monotonic()
+                done_ns = time.perf_counter_ns()
+                for key, _ in events:
+                    index = key.data
+                    sock, start_ns, _ = in_flight.pop(index)
+                    selector.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if err == 0:
+                        finish(index, done_ns - start_ns, None)
+                    elif err == errno.ECONNREFUSED:
+                        fail(index, "连接被拒绝", retryable=False)
+                    else:
+                        fail(index, f"网络错误: {os.strerror(err)}", retryable=True)
+
+                # 处理超时的连接
+                for index in [i for i, (_, _, deadline) in in_flight.items() if deadline <= now]:
+                    sock, _, _ = in_flight.pop(index)
+                    selector.unregister(sock)
+                    sock.close()
+                    fail(index, "连接超时", retryable=True)
+        finally:
+            for sock, _, _ in in_flight.values():
+                sock.close()
+            selector.close()
+
+        report_progress()
+        return results
+
     def filter_best_ips(self, results: list, max_delay: float = 300, min_speed: float = 0,
                         top_n: int = 10) -> list:
         """
@@ -372,21 +902,25 @@ class BatchIPTester:
         Returns:
             排序后的最优IP列表
         """
-        # 筛选成功的结果
-        valid_results = [r for r in results if r.success and r.tcp_delay is not None]
-
-        # 应用延迟过滤
-        if max_delay > 0:
-            valid_results = [r for r in valid_results if r.tcp_delay <= max_delay]
-
-        # 应用速度过滤
-        if min_speed > 0:
-            valid_results = [r for r in valid_results if r.download_speed and r.download_speed >= min_speed]
-
-        # 排序: 优先延迟低,其次速度快
-        valid_results.sort(key=lambda r: (
-            r.tcp_delay,  # 延迟越小越好
-            -(r.download_speed or 0)  # 速度越大越好(负号反转排序)
-        ))
-
-        return valid_results[:top_n]
+        # 单次遍历完成筛选,同时生成排序键: 优先延迟低,其次速度快
+        # 元组比较在C层完成,省去逐元素调用 key 函数; 序号保证结果稳定且不比较对象本身
+        check_delay = max_delay > 0
+        check_speed = min_speed > 0
+        ranked = []
+        for index, r in enumerate(results):
+            delay = r.tcp_delay
+            if not r.success or delay is None:
+                continue
+            if check_delay and delay > max_delay:
+                continue
+            speed = r.download_speed
+            if check_speed and not (speed and speed >= min_speed):
+                continue
+            # 按整数纳秒排序; 外部构造、只有毫秒值的结果按毫秒换算
+            delay_ns = r.tcp_delay_ns
+            if delay_ns is None:
+                delay_ns = round(delay * 1_000_000)
+            ranked.append((delay_ns, -(speed or 0), index, r))
+
+        # 只需前 top_n 个: 堆选择为 O(N log top_n),无需完整排序
+        return [entry[3] for entry in heapq.nsmallest(top_n, ranked)]
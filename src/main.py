@@ -12,11 +12,17 @@ import csv
 from pathlib import Path
 from datetime import datetime
 import logging
-from typing import List
+from typing import Dict, List, Tuple
 
-from api_client import BestIPAPIClient, ServerEndpoint
+try:
+    import orjson  # 可选依赖: 更快地序列化JSON结果
+except ImportError:
+    orjson = None
+
+from api_client import BestIPAPIClient
+from models import ServerEndpoint
 from ip_tester import BatchIPTester, TestResult
-from cloudflare_ips import CloudflareCDNProvider
+from cloudflare_ips import CloudflareCDNProvider, cdn_provider
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +33,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+CSV_HEADER = [
+    'IP地址', '端口', '回源端口', 'TLS', '数据中心', '地区', '国家', '城市',
+    'IATA', 'ASN', 'TCP延迟(ms)', '下载速度(MB/s)', '状态'
+]
+
+# 流式写入CSV时每写入多少行刷新一次文件
+CSV_FLUSH_INTERVAL = 100
+
+# 两阶段测试时参与测速的IP数量 = 显示数量(--top) x 此系数
+SPEED_CANDIDATE_FACTOR = 5
+
 
 class CloudflareSpeedTestApp:
     """BestIP应用主类"""
@@ -37,7 +54,7 @@ class CloudflareSpeedTestApp:
             api_server=args.api_server,
             timeout=args.timeout
         )
-        self.cf_ip_db = CloudflareCDNProvider()  # Cloudflare IP数据库
+        self.cf_ip_db = cdn_provider  # Cloudflare IP数据库(共享全局实例及其缓存)
         self.batch_tester = BatchIPTester(
             max_workers=args.workers,
             tcp_timeout=args.tcp_timeout,
@@ -46,6 +63,15 @@ class CloudflareSpeedTestApp:
         self.results_dir = Path(args.output_dir)
         self.results_dir.mkdir(parents=True, exist_ok=True)
 
+        # CSV 结果在测试过程中逐条写入 (见 _open_csv_stream)
+        self._csv_file = None
+        self._csv_writer = None
+        self._csv_path = None
+        self._csv_tmp_path = None
+        self._csv_rows = 0
+        self._csv_skipped = 0
+        self._location_map = {}
+
     def progress_callback(self, completed: int, total: int, result: TestResult):
         """进度回调"""
         percentage = (completed / total) * 100
@@ -57,8 +83,11 @@ class CloudflareSpeedTestApp:
         msg = f"[{completed}/{total} {percentage:.1f}%] {status} {result.ip}:{result.port} 延迟:{delay_str} 速度:{speed_str}"
         logger.info(msg)
 
+        if self._csv_writer is not None:
+            self._write_csv_row(result)
+
     def save_results(self, results: List[TestResult], locations: List[ServerEndpoint], format: str = 'csv'):
-        """保存结果到文件（仅保存有延迟数据的IP）"""
+        """保存结果到文件（仅保存有延迟数据的IP）; run() 中的CSV结果改为测试过程中流式写入"""
         # 过滤掉延迟为空的结果
         original_count = len(results)
         filtered_results = [r for r in results if r.tcp_delay is not None]
@@ -73,60 +102,107 @@ class CloudflareSpeedTestApp:
         # 记录过滤统计
         logger.info(f"准备保存结果: 总计 {original_count} 个，有效 {filtered_count} 个，跳过 {skipped_count} 个（延迟为空）")
 
+        # 创建 (IP, 端口) 到位置的映射,两种格式共用
+        location_map = self._build_location_map(locations)
 
         if format == 'csv':
             filename = self.results_dir / f"cf_speedtest_results.csv"
-            self._save_csv(filtered_results, locations, filename)
+            self._save_csv(filtered_results, location_map, filename)
         elif format == 'json':
             filename = self.results_dir / f"cf_speedtest_results.json"
-            self._save_json(filtered_results, locations, filename)
+            self._save_json(filtered_results, location_map, filename)
         else:
             logger.error(f"不支持的格式: {format}")
             return
 
         logger.info(f"结果已保存到: {filename} (共 {filtered_count} 条记录)")
 
-    def _save_csv(self, results: List[TestResult], locations: List[ServerEndpoint], filename: Path):
-        """保存为CSV格式"""
-        # 创建IP到位置的映射
-        location_map = {f"{loc.ip}:{loc.port}": loc for loc in locations}
+    @staticmethod
+    def _build_location_map(locations: List[ServerEndpoint]) -> Dict[Tuple[str, int], ServerEndpoint]:
+        """创建 (IP, 端口) 到位置信息的映射"""
+        return {(loc.ip, loc.port): loc for loc in locations}
 
+    def _open_csv_stream(self, locations: List[ServerEndpoint]):
+        """
+        打开CSV结果文件,测试过程中每完成一个IP即写入一行,中断时已完成的结果不会丢失
+
+        结果先写入 .part 临时文件,关闭时再替换正式文件; 没有有效结果时保留上次的结果文件
+        """
+        self._location_map = self._build_location_map(locations)
+        self._csv_path = self.results_dir / "cf_speedtest_results.csv"
+        self._csv_tmp_path = self._csv_path.with_name(self._csv_path.name + '.part')
+        self._csv_file = open(self._csv_tmp_path, 'w', newline='', encoding='utf-8', buffering=1 << 20)
+        self._csv_writer = csv.writer(self._csv_file)
+        self._csv_writer.writerow(CSV_HEADER)
+        self._csv_rows = 0
+        self._csv_skipped = 0
+
+    def _write_csv_row(self, result: TestResult):
+        """写入一条CSV结果（跳过延迟为空的IP）"""
+        if result.tcp_delay is None:
+            self._csv_skipped += 1
+            return
+
+        loc = self._location_map.get((result.ip, result.port))
+        self._csv_writer.writerow(self._csv_row(result, loc))
+        self._csv_rows += 1
+        if self._csv_rows % CSV_FLUSH_INTERVAL == 0:
+            self._csv_file.flush()
+
+    def _close_csv_stream(self):
+        """关闭CSV结果文件,替换正式结果文件并输出保存统计"""
+        if self._csv_file is None:
+            return
+
+        self._csv_file.close()
+        self._csv_file = None
+        self._csv_writer = None
+
+        if self._csv_rows == 0:
+            # 没有有效结果时丢弃临时文件,保留上次的结果
+            self._csv_tmp_path.unlink()
+            logger.warning("没有有效的测试结果（所有IP延迟为空），跳过保存")
+            return
+
+        self._csv_tmp_path.replace(self._csv_path)  # 原子替换 (os.replace)
+        logger.info(f"结果已保存到: {self._csv_path} (共 {self._csv_rows} 条记录，"
+                    f"跳过 {self._csv_skipped} 个（延迟为空）)")
+
+    def _save_csv(self, results: List[TestResult],
+                  location_map: Dict[Tuple[str, int], ServerEndpoint], filename: Path):
+        """保存为CSV格式"""
         with open(filename, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
-            writer.writerow([
-                'IP地址', '端口', '回源端口', 'TLS', '数据中心', '地区', '国家', '城市',
-                'IATA', 'ASN', 'TCP延迟(ms)', '下载速度(MB/s)', '状态'
-            ])
-
+            writer.writerow(CSV_HEADER)
             for result in results:
-                key = f"{result.ip}:{result.port}"
-                loc = location_map.get(key)
-
-                row = [
-                    result.ip,
-                    result.port,
-                    loc.source_port if loc else '',
-                    'Yes' if (loc and loc.tls) else 'No',
-                    loc.datacenter if loc else '',
-                    loc.region if loc else '',
-                    loc.country if loc else '',
-                    loc.city if loc else '',
-                    loc.iata if loc else '',
-                    loc.asn if loc else '',
-                    f"{result.tcp_delay:.2f}" if result.tcp_delay else '',
-                    f"{result.download_speed:.2f}" if result.download_speed else '',
-                    '成功' if result.success else f'失败: {result.error}'
-                ]
-                writer.writerow(row)
-
-    def _save_json(self, results: List[TestResult], locations: List[ServerEndpoint], filename: Path):
+                loc = location_map.get((result.ip, result.port))
+                writer.writerow(self._csv_row(result, loc))
+
+    @staticmethod
+    def _csv_row(result: TestResult, loc) -> list:
+        """生成一行CSV数据"""
+        return [
+            result.ip,
+            result.port,
+            loc.source_port if loc else '',
+            'Yes' if (loc and loc.tls) else 'No',
+            loc.datacenter if loc else '',
+            loc.region if loc else '',
+            loc.country if loc else '',
+            loc.city if loc else '',
+            loc.iata if loc else '',
+            loc.asn if loc else '',
+            f"{result.tcp_delay:.2f}" if result.tcp_delay else '',
+            f"{result.download_speed:.2f}" if result.download_speed else '',
+            '成功' if result.success else f'失败: {result.error}'
+        ]
+
+    def _save_json(self, results: List[TestResult],
+                   location_map: Dict[Tuple[str, int], ServerEndpoint], filename: Path):
         """保存为JSON格式"""
-        location_map = {f"{loc.ip}:{loc.port}": loc for loc in locations}
-
         output = []
         for result in results:
-            key = f"{result.ip}:{result.port}"
-            loc = location_map.get(key)
+            loc = location_map.get((result.ip, result.port))
 
             item = {
                 'ip': result.ip,
@@ -151,6 +227,11 @@ class CloudflareSpeedTestApp:
 
             output.append(item)
 
+        if orjson is not None:
+            # orjson 直接输出UTF-8字节, 缩进与非ASCII字符处理同下方 json.dump
+            filename.write_bytes(orjson.dumps(output, option=orjson.OPT_INDENT_2))
+            return
+
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(output, f, indent=2, ensure_ascii=False)
 
@@ -215,8 +296,7 @@ class CloudflareSpeedTestApp:
             print("\n开始测试IP性能...")
 
             # 根据端口判断是否使用TLS
-            tls_ports = {443, 2053, 2083, 2087, 2096, 8443}
-            use_tls = self.args.port in tls_ports if self.args.port else True
+            use_tls = self.args.port in CloudflareCDNProvider.SECURE_PORTS if self.args.port else True
 
             # 检查第一个IP的TLS配置
             if locations and hasattr(locations[0], 'tls'):
@@ -224,12 +304,19 @@ class CloudflareSpeedTestApp:
 
             logger.info(f"使用{'TLS/HTTPS' if use_tls else 'HTTP'}进行测试")
 
+            if self.args.save and self.args.format == 'csv':
+                self._open_csv_stream(locations)
+
+            # 默认先探测全部IP的TCP延迟,只对延迟最低的候选IP测速; --full-scan 时逐个完整测试
+            speed_candidates = None if self.args.full_scan else self.args.top_n * SPEED_CANDIDATE_FACTOR
+
             results = self.batch_tester.test_ips(
                 ip_list=locations,
                 test_speed=self.args.test_speed,
                 use_tls=use_tls,
                 custom_speed_url=speed_test_url,  # 使用API返回的真实速度测试URL
-                progress_callback=self.progress_callback
+                progress_callback=self.progress_callback,
+                speed_candidates=speed_candidates
             )
             print()  # 换行
 
@@ -251,8 +338,10 @@ class CloudflareSpeedTestApp:
                 speed_str = f"{result.download_speed:.2f}MB/s" if result.download_speed else "N/A"
                 print(f"{i}. {result.ip}:{result.port} - 延迟: {delay_str}, 速度: {speed_str}")
 
-            # 6. 保存结果
-            if self.args.save:
+            # 6. 保存结果 (CSV 已在测试过程中写入)
+            if self._csv_file is not None:
+                self._close_csv_stream()
+            elif self.args.save:
                 self.save_results(results, locations, self.args.format)
 
             logger.info("\n程序执行完成!")
@@ -265,6 +354,7 @@ class CloudflareSpeedTestApp:
             logger.error(f"程序执行出错: {e}", exc_info=True)
             return 1
         finally:
+            self._close_csv_stream()
             self.api_client.close()
 
 
@@ -279,6 +369,7 @@ def main():
   %(prog)s --iata LAX                # 只测试洛杉矶地区IP
   %(prog)s --port 443 --top 5        # 测试443端口,显示前5个最优IP
   %(prog)s --no-speed --max-ips 50   # 只测试TCP延迟,最多50个IP
+  %(prog)s --full-scan               # 对每个IP都测速 (默认只测延迟最低的候选IP)
   %(prog)s --max-delay 200           # 筛选延迟<200ms的IP并保存
   %(prog)s --no-save                 # 测试但不保存结果
         """
@@ -302,6 +393,8 @@ def main():
                        help='速度测试超时时间(秒) (默认: 30)')
     parser.add_argument('--no-speed', dest='test_speed', action='store_false',
                        help='不测试下载速度,仅测TCP延迟')
+    parser.add_argument('--full-scan', action='store_true',
+                       help='对所有IP测速 (默认先测TCP延迟,只对延迟最低的 top×5 个IP测速)')
 
     # 筛选参数
     parser.add_argument('--max-delay', type=float, default=300,
@@ -0,0 +1,48 @@
+"""
+数据模型模块
+
+定义各模块共享的数据类,避免同一模型在多个模块中重复定义。
+"""
+
+import sys
+from dataclasses import dataclass
+from typing import Optional
+
+# Python 3.10+ 支持 dataclass(slots=True),省去实例 __dict__;旧版本退化为普通 dataclass
+DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**DATACLASS_SLOTS)
+class ServerEndpoint:
+    """
+    CDN服务器端点信息
+
+    存储单个CDN节点的完整配置信息,包括网络地址、端口配置、
+    地理位置数据以及性能测试结果。
+
+    Attributes:
+        ip: IPv4地址
+        port: 服务端口
+        source_port: 源端口(0表示系统自动分配)
+        tls: 是否启用TLS加密
+        datacenter: 数据中心标识
+        region: 地理区域
+        country: 国家/地区代码
+        city: 城市名称
+        iata: IATA机场代码(用于地理位置标识)
+        asn: 自治系统号(Cloudflare ASN: 13335)
+        tcp_delay: TCP连接延迟(毫秒),测试后填充
+        download_speed: 下载速度(MB/s),测试后填充
+    """
+    ip: str
+    port: int
+    source_port: int = 0
+    tls: bool = False
+    datacenter: str = ""
+    region: str = ""
+    country: str = ""
+    city: str = ""
+    iata: str = ""
+    asn: int = 13335  # Cloudflare官方ASN编号
+    tcp_delay: Optional[float] = None
+    download_speed: Optional[float] = None